@@ -11,7 +11,9 @@
 # pandas==2.2.2
 # rapidfuzz==3.9.6
 
-import io, re, math, pathlib
+import io, pathlib
+from functools import lru_cache
+import numpy as np
 import pandas as pd
 import streamlit as st
 
@@ -68,59 +70,69 @@ div[data-testid="stVerticalBlock"] > div[style*="border: 1px solid rgba(49, 51,
 """, unsafe_allow_html=True)
 
 # ---------- Helpers ----------
-def canon(s: str) -> str:
-    return re.sub(r"\s+", " ", str(s or "")).strip()
-
-def keyify(brand, pname, ptype=""):
-    return (str(brand or "") + "|" + str(pname or "") + "|" + str(ptype or "")).strip().lower()
-
-def to_float(x):
-    try: return float(x)
-    except: return math.nan
-
-def yt_link(vid, t):
-    try:
-        sec = int(float(t))
-        return f"https://www.youtube.com/watch?v={vid}&t={sec}s"
-    except Exception:
+# Python's str \s spelled out: Arrow runs the regex in RE2, whose \s is ASCII-only and would
+# leave NBSP / U+2009 / U+3000 (common in text pasted from the web) uncollapsed. Kept as a
+# plain string: pandas hands it straight to Arrow, so a compiled re.Pattern would go unused
+_WS_PAT = "[\t-\r\x1c-\x1f \x85\xa0\u1680\u2000-\u200a\u2028\u2029\u202f\u205f\u3000]+"
+
+def canon_series(s: pd.Series) -> pd.Series:
+    # collapse whitespace and trim whole columns; casting to string[pyarrow] keeps Arrow-loaded
+    # columns from falling back to objects; cast before filling, since an all-blank
+    # (null[pyarrow]) or int64[pyarrow] column rejects ""
+    return (s.astype("string[pyarrow]").fillna("")
+             .str.replace(_WS_PAT, " ", regex=True).str.strip())
+
+def keyify_cols(brand, pname, ptype=""):
+    # "brand|product|type" match keys over aligned Series; a missing column may be passed as ""
+    def col(x): return x.fillna("").astype(str) if isinstance(x, pd.Series) else str(x or "")
+    return (col(brand) + "|" + col(pname) + "|" + col(ptype)).str.strip().str.lower()
+
+@lru_cache(maxsize=4096)
+def yt_link(vid: str, sec=None):
+    # sec: whole seconds (int) or None; callers coerce so equal timestamps share a cache slot
+    if sec is None:
         return f"https://www.youtube.com/watch?v={vid}"
+    return f"https://www.youtube.com/watch?v={vid}&t={sec}s"
 
 def section(title: str):
     st.markdown(f"<div class='section-title'>{title}</div>", unsafe_allow_html=True)
 
 # ---------- Load data ----------
-@st.cache_data
+# cache_resource hands back the same objects on every rerun instead of hashing and
+# unpickling the frames each time; callers must treat them as read-only
+# (content_df is .copy()'d before it is mutated below).
+@st.cache_resource
 def load_catalog_and_content():
     assert CAT_CSV.exists(), f"Missing catalog: {CAT_CSV}"
-    cat = pd.read_csv(CAT_CSV)
+    # the catalog is all strings and goes straight through canon_series, so keep it Arrow-backed
+    cat = pd.read_csv(CAT_CSV, engine="pyarrow", dtype_backend="pyarrow")
 
     # normalize catalog fields
-    cat["Brand_n"]         = cat["Brand"].map(canon)
-    cat["Product Name_n"]  = cat["Product Name"].map(canon)
-    cat["Product Type_n"]  = cat["Product Type"].map(canon)
-    cat["Category Group_n"]= cat["Category Group"].map(canon)
-    cat["prod_l"]          = (cat["Product Name_n"] + " " + cat["Product Type_n"]).str.lower().map(canon)
+    cat["Brand_n"]         = canon_series(cat["Brand"])
+    cat["Product Name_n"]  = canon_series(cat["Product Name"])
+    cat["Product Type_n"]  = canon_series(cat["Product Type"])
+    cat["Category Group_n"]= canon_series(cat["Category Group"])
+    cat["prod_l"]          = canon_series((cat["Product Name_n"] + " " + cat["Product Type_n"]).str.lower())
     cat["brand_l"]         = cat["Brand_n"].str.lower()
+    # brand_l -> catalog row positions, so matching never rescans the brand column; returned
+    # alongside the frame (not in cat.attrs, which pandas deep-copies into every derived frame)
+    brand_groups = cat.groupby("brand_l").indices
 
     # choose routine or mentions
     if ROUT_CSV.exists():
-        df = pd.read_csv(ROUT_CSV)
+        df = pd.read_csv(ROUT_CSV, engine="pyarrow")
         source = "routine"
         df["videoId"] = df["videoId"].astype(str)
-        df["key"] = df.apply(lambda r: keyify(r.get("brand",""),
-                                             r.get("product",""),
-                                             r.get("product_type","")), axis=1)
+        df["key"] = keyify_cols(df.get("brand",""), df.get("product",""), df.get("product_type",""))
         df["time"] = df.get("time_start", None)
         if "title" not in df.columns: df["title"] = df["videoId"]
         if "step"  not in df.columns: df["step"]  = ""
         if "shade" not in df.columns: df["shade"] = ""
     elif MENT_CSV.exists():
-        df = pd.read_csv(MENT_CSV)
+        df = pd.read_csv(MENT_CSV, engine="pyarrow")
         source = "mentions"
         df["videoId"] = df["videoId"].astype(str)
-        df["key"]  = df.apply(lambda r: keyify(r.get("Brand",""),
-                                              r.get("Product Name",""),
-                                              r.get("Product Type","")), axis=1)
+        df["key"]  = keyify_cols(df.get("Brand",""), df.get("Product Name",""), df.get("Product Type",""))
         df["time"] = df.get("chunk_start", None)
         if "title" not in df.columns: df["title"] = df["videoId"]
         if "step"  not in df.columns: df["step"]  = ""
@@ -129,9 +141,14 @@ def load_catalog_and_content():
     else:
         raise FileNotFoundError("Missing both routine_per_video.csv and mentions.csv in /data")
 
-    return cat, df, source
+    # integer key codes: kit membership becomes an int lookup instead of string hashing per row;
+    # the code -> key Index is returned separately (attrs would be deep-copied per derived frame)
+    df["key_code"], key_uniques = pd.factorize(df["key"])
+    key_index = pd.Index(key_uniques)
 
-catalog, content_df, content_source = load_catalog_and_content()
+    return cat, brand_groups, df, key_index, source
+
+catalog, catalog_groups, content_df, content_keys, content_source = load_catalog_and_content()
 
 # ---------- Sidebar: upload user's kit ----------
 st.title("Looks for My Kit — Demo")
@@ -163,7 +180,7 @@ def find_col(df, names):
         if n.lower() in low: return low[n.lower()]
     return None
 
-def match_kit_to_catalog(kit_raw: pd.DataFrame, cat: pd.DataFrame, min_score=70):
+def match_kit_to_catalog(kit_raw: pd.DataFrame, cat: pd.DataFrame, min_score=70, groups=None):
     bcol = find_col(kit_raw, ["Brand"])
     pcol = find_col(kit_raw, ["Product Name","Product"])
     tcol = find_col(kit_raw, ["Product Type","Type"])
@@ -172,53 +189,66 @@ def match_kit_to_catalog(kit_raw: pd.DataFrame, cat: pd.DataFrame, min_score=70)
         raise ValueError("Your CSV must include 'Brand' and 'Product Name' columns.")
 
     kit = kit_raw.copy()
-    kit["Brand_n"]        = kit[bcol].map(canon)
-    kit["Product Name_n"] = kit[pcol].map(canon)
-    kit["Product Type_n"] = kit[tcol].map(canon) if tcol else ""
-    kit["Shade Name_n"]   = kit[scol].map(canon) if scol else ""
-    kit["query_l"]        = (kit["Product Name_n"] + " " + kit["Product Type_n"]).str.lower().map(canon)
+    kit["Brand_n"]        = canon_series(kit[bcol])
+    kit["Product Name_n"] = canon_series(kit[pcol])
+    kit["Product Type_n"] = canon_series(kit[tcol]) if tcol else ""
+    kit["Shade Name_n"]   = canon_series(kit[scol]) if scol else ""
+    # built the same way as prod_l; cdist compares them as-is (processor=None)
+    kit["query_l"]        = canon_series((kit["Product Name_n"] + " " + kit["Product Type_n"]).str.lower())
     kit["brand_l"]        = kit["Brand_n"].str.lower()
 
-    rows = []
-    for _, r in kit.iterrows():
-        pool = cat[cat["brand_l"] == r["brand_l"]]
-        if pool.empty:
-            pool = cat
-        res = process.extractOne(r["query_l"], pool["prod_l"].tolist(), scorer=fuzz.token_set_ratio)
-        if res:
-            matched, score = res[0], int(res[1])
-            crow = pool[pool["prod_l"] == matched].iloc[0]
-            rows.append({
-                "Brand": r["Brand_n"],
-                "Product Name": r["Product Name_n"],
-                "Product Type": r["Product Type_n"],
-                "Shade Name": r["Shade Name_n"],
-                "Matched Brand": crow["Brand_n"],
-                "Matched Product Name": crow["Product Name_n"],
-                "Matched Product Type": crow["Product Type_n"],
-                "Matched Category Group": crow["Category Group_n"],
-                "Match Score": score
-            })
-        else:
-            rows.append({
-                "Brand": r["Brand_n"], "Product Name": r["Product Name_n"],
-                "Product Type": r["Product Type_n"], "Shade Name": r["Shade Name_n"],
-                "Matched Brand": "", "Matched Product Name": "",
-                "Matched Product Type": "", "Matched Category Group": "",
-                "Match Score": 0
-            })
-    out = pd.DataFrame(rows)
-    out["key"] = out.apply(lambda r: keyify(r["Matched Brand"], r["Matched Product Name"], r["Matched Product Type"]), axis=1)
+    out = pd.DataFrame({
+        "Brand": kit["Brand_n"].to_numpy(),
+        "Product Name": kit["Product Name_n"].to_numpy(),
+        "Product Type": kit["Product Type_n"].to_numpy(),
+        "Shade Name": kit["Shade Name_n"].to_numpy(),
+    })
+    n = len(kit)
+    if n and len(cat):
+        # prune before scoring: kit rows are scored in one batched call per brand, against
+        # that brand's catalog slice only (whole catalog if the brand is unknown)
+        queries = kit["query_l"].tolist()
+        cat_l   = cat["prod_l"].to_numpy()
+        if groups is None: groups = cat.groupby("brand_l").indices
+        all_idx = np.arange(len(cat))
+        best = np.empty(n, dtype=np.intp)
+        best_score = np.empty(n, dtype=np.uint8)
+        for b, rows in kit.groupby("brand_l", sort=False).indices.items():
+            idx = groups.get(b, all_idx)
+            # candidates below min_score exit early and come back as 0
+            scores = process.cdist([queries[i] for i in rows], cat_l[idx].tolist(),
+                                   scorer=fuzz.token_set_ratio, processor=None,
+                                   score_cutoff=min_score, workers=-1, dtype=np.uint8)
+            arg = scores.argmax(axis=1)
+            best[rows] = idx[arg]
+            best_score[rows] = scores[np.arange(len(rows)), arg]
+        crow  = cat.iloc[best]
+        found = best_score > 0  # all-zero row: nothing cleared the cutoff
+        out["Matched Brand"]          = np.where(found, crow["Brand_n"].to_numpy(), "")
+        out["Matched Product Name"]   = np.where(found, crow["Product Name_n"].to_numpy(), "")
+        out["Matched Product Type"]   = np.where(found, crow["Product Type_n"].to_numpy(), "")
+        out["Matched Category Group"] = np.where(found, crow["Category Group_n"].to_numpy(), "")
+        out["Match Score"]            = best_score  # stays uint8 end to end
+    else:
+        out["Matched Brand"] = out["Matched Product Name"] = ""
+        out["Matched Product Type"] = out["Matched Category Group"] = ""
+        out["Match Score"] = np.zeros(n, dtype=np.uint8)
+    out["key"] = keyify_cols(out["Matched Brand"], out["Matched Product Name"], out["Matched Product Type"])
     out_keep = out[out["Match Score"] >= min_score].copy()
     return out, out_keep
 
+@st.cache_data(show_spinner=False)
+def match_uploaded_kit(kit_bytes: bytes, min_score=70):
+    # keyed on the raw upload + threshold, so reruns that change neither skip matching
+    kit_raw = pd.read_csv(io.BytesIO(kit_bytes))
+    return match_kit_to_catalog(kit_raw, catalog, min_score=min_score, groups=catalog_groups)
+
 if kit_file is None:
     section("2) Kit → Catalog matching")
     st.info("Upload your kit CSV in the sidebar to run the demo.")
     st.stop()
 
-kit_raw = pd.read_csv(kit_file)
-matched_all, matched_keep = match_kit_to_catalog(kit_raw, catalog, min_score=min_score)
+matched_all, matched_keep = match_uploaded_kit(kit_file.getvalue(), min_score=min_score)
 
 with st.expander("2) Kit → Catalog matching", expanded=True):
     c1, c2 = st.columns([2,1])
@@ -233,10 +263,11 @@ owned_keys = set(matched_keep["key"])
 
 # ---------- Intersections with content ----------
 df = content_df.copy()
-df["sec"] = df["time"].map(to_float)
+df["sec"] = pd.to_numeric(df["time"], errors="coerce").astype("float32")
 df["videoId"] = df["videoId"].astype(str)
 
-hits = df[df["key"].isin(owned_keys)].copy()
+owned_codes = content_keys.get_indexer(list(owned_keys))
+hits = df[np.isin(df["key_code"].to_numpy(), owned_codes[owned_codes >= 0])].copy()
 if hits.empty:
     section("3) Videos that use your products")
     st.caption(f"Data source: {content_source}")
@@ -244,25 +275,26 @@ if hits.empty:
     st.stop()
 
 # Rank videos
-agg_rows = []
-for vid, g in hits.groupby("videoId", sort=False):
-    title = g["title"].iloc[0]
-    used  = g["key"].nunique()
-    steps = g.get("step","").nunique() if "step" in g.columns else used
-    coverage = used / max(1, len(owned_keys))
-    early = g["sec"].dropna()
-    early_boost = 1.15 if (not early.empty and early.median() < 600) else 1.0
-    score = (0.7*coverage + 0.3*(steps/10)) * early_boost
-    agg_rows.append({"videoId": vid, "title": title, "used_items": used, "used_steps": steps,
-                     "coverage": round(coverage,3), "score": round(score,3)})
-
-rank = pd.DataFrame(agg_rows).sort_values(["score","used_items"], ascending=[False,False]).reset_index(drop=True)
-
-# Map: videoId -> all items (for complementary products)
-all_items = df.groupby("videoId").apply(lambda g: g.to_dict("records")).to_dict()
-
-# Render helper (no Ellipsis)
-def render_item_line(vid, step, brand, prod, ptype, shade, sec):
+agg = hits.groupby("videoId", sort=False).agg(
+    title=("title", "first"), used_items=("key", "nunique"),
+    used_steps=("step", "nunique"), median_sec=("sec", "median"),
+).reset_index()
+coverage    = agg["used_items"] / max(1, len(owned_keys))
+early_boost = np.where(agg["median_sec"] < 600, 1.15, 1.0)
+agg["coverage"] = coverage.round(3)
+agg["score"]    = ((0.7*coverage + 0.3*(agg["used_steps"]/10)) * early_boost).round(3)
+
+rank = (agg.drop(columns="median_sec")
+           .sort_values(["score","used_items"], ascending=[False,False]).reset_index(drop=True))
+
+top = rank.head(30)
+
+# Map: videoId -> all items (for complementary products), only for the videos we render
+top_df = df[df["videoId"].isin(set(top["videoId"]))]
+all_items = {vid: g.to_dict("records") for vid, g in top_df.groupby("videoId", sort=False)}
+
+# Render helper (no Ellipsis); lines are joined so each list is a single st.markdown call
+def format_item_line(vid, step, brand, prod, ptype, shade, sec) -> str:
     step  = str(step or ""); brand = str(brand or ""); prod = str(prod or "")
     ptype = str(ptype or ""); shade = str(shade or "")
     try:
@@ -270,18 +302,18 @@ def render_item_line(vid, step, brand, prod, ptype, shade, sec):
     except Exception:
         ttxt = "open"; link = yt_link(vid, None)
     meta = " · ".join([x for x in [ptype, f"Shade: {shade}" if shade else ""] if x])
-    st.markdown(
+    return (
         f"- **{brand} — {prod}**  \n"
         f"  <span class='small'>{step} {meta}</span> — "
-        f"[Jump {ttxt}]({link})",
-        unsafe_allow_html=True
+        f"[Jump {ttxt}]({link})"
     )
 
 # ---------- Video grid (2 tiles per row) ----------
 section("3) Videos that use your products")
 st.caption(f"Data source: {content_source}")
 
-videos = rank.head(30).to_dict("records")
+videos = top.to_dict("records")
+hits_by_vid = {vid: g.sort_values("sec") for vid, g in hits.groupby("videoId", sort=False)}
 for i in range(0, len(videos), 2):
     cols = st.columns(2)
     for col, R in zip(cols, videos[i:i+2]):
@@ -292,7 +324,7 @@ for i in range(0, len(videos), 2):
 
                 st.markdown(
                     f"### {title} &nbsp; "
-                    f"[🔹 Open](https://www.youtube.com/watch?v={vid})",
+                    f"[🔹 Open]({yt_link(vid)})",
                     unsafe_allow_html=True
                 )
 
@@ -303,31 +335,33 @@ for i in range(0, len(videos), 2):
 
                 # Your kit matches (chronological)
                 st.write("**Your kit items in this video**")
-                sub = hits[hits["videoId"] == vid].sort_values("sec")
-                if sub.empty:
+                sub = hits_by_vid.get(vid)
+                if sub is None or sub.empty:
                     st.caption("No kit items detected in this video.")
                 else:
-                    for _, it in sub.iterrows():
-                        render_item_line(
+                    st.markdown("\n".join(
+                        format_item_line(
                             vid=vid,
-                            step  = it.get("step",""),
-                            brand = it.get("brand",""),
-                            prod  = it.get("product",""),
-                            ptype = it.get("product_type",""),
-                            shade = it.get("shade",""),
-                            sec   = it.get("sec", None),
+                            step  = getattr(it, "step", ""),
+                            brand = getattr(it, "brand", ""),
+                            prod  = getattr(it, "product", ""),
+                            ptype = getattr(it, "product_type", ""),
+                            shade = getattr(it, "shade", ""),
+                            sec   = getattr(it, "sec", None),
                         )
+                        for it in sub.itertuples(index=False)
+                    ), unsafe_allow_html=True)
 
                 # Complementary products (red left border + de-duped)
                 comps = [d for d in all_items.get(vid, []) if d["key"] not in owned_keys]
                 if comps:
                     st.markdown("<div class='comps'>**Complementary products**</div>", unsafe_allow_html=True)
-                    seen = set()
+                    seen, lines = set(), []
                     for d in sorted(comps, key=lambda x: (x.get("sec") if pd.notna(x.get("sec")) else 9e9)):
                         if d["key"] in seen: 
                             continue
                         seen.add(d["key"])
-                        render_item_line(
+                        lines.append(format_item_line(
                             vid=vid,
                             step  = d.get("step",""),
                             brand = d.get("brand",""),
@@ -335,4 +369,5 @@ for i in range(0, len(videos), 2):
                             ptype = d.get("product_type",""),
                             shade = d.get("shade",""),
                             sec   = d.get("sec", None),
-                        )
+                        ))
+                    st.markdown("\n".join(lines), unsafe_allow_html=True)
@@ -2,11 +2,15 @@
 # build_gazetteers.py — Generate cosmetics gazetteers from sku_catalog.csv
 # Outputs sorted, deduped TSV/TXT files for weak-labeling & NER bootstrapping.
 
-import argparse, csv, re, unicodedata
+import argparse, csv, os, re, sys, unicodedata
 from pathlib import Path
 from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from functools import lru_cache
+from typing import TYPE_CHECKING
 
-import pandas as pd
+if TYPE_CHECKING:                    # pandas is only imported for --engine pandas/polars
+    import pandas as pd
 
 # -------------------------
 # Seeds (edit here, not in the weak labeler)
@@ -36,6 +40,10 @@ STEM_STOPWORDS = {
     "volumizing","lengthening"
 }
 STEM_MIN_TOK, STEM_MAX_TOK = 2, 5
+# stems containing any of these get the lower 0.7 weight
+STEM_HEAVY_WORDS = ["tinted moisturizer","foundation","powder","palette","lip oil","lip gloss"]
+
+CATALOG_COLS = ["Brand","Product Name","Product Type","Category Group","Shade Name"]
 
 TOOL_SEEDS = [
     ("beauty blender", "beauty blender", 1.0),
@@ -67,58 +75,155 @@ STOP_PHRASES = [
     "a bit of","gonna","i'm going to","like a","sort of","this is","we are going to","you guys"
 ]
 
+# compiled once for downstream matchers that import this module
+SHADE_RE = [re.compile(p) for p in SHADE_PATTERNS]
+TOOL_RE  = [re.compile(p) for p in TOOL_PATTERNS]
+
+# the .txt outputs are pure functions of the seeds above: dedup + sort once at import
+_SHADE_SET, _TOOL_SET, _STOP_SET = frozenset(SHADE_PATTERNS), frozenset(TOOL_PATTERNS), frozenset(STOP_PHRASES)
+_SHADE_TXT = "\n".join(sorted(_SHADE_SET)) + "\n"
+_TOOL_TXT  = "\n".join(sorted(_TOOL_SET)) + "\n"
+_STOP_TXT  = "\n".join(sorted(_STOP_SET)) + "\n"
+
 # -------------------------
 # Helpers
 # -------------------------
 
+_WS_RE      = re.compile(r"\s+")
+_TOKS_RE    = re.compile(r"[A-Za-z0-9#\-/&']+")
+_NUMERIC_RE = re.compile(r"[0-9#]+")
+_HEAVY_RE   = re.compile("|".join(map(re.escape, STEM_HEAVY_WORDS)))
+
+@lru_cache(maxsize=100_000)
 def norm(s: str) -> str:
     s = str(s or "").strip()
-    s = unicodedata.normalize("NFKC", s)
-    s = re.sub(r"\s+", " ", s)
-    return s
+    if not s.isascii():                  # ASCII is already NFKC; normalize() quick-checks the rest
+        s = unicodedata.normalize("NFKC", s)
+    return _WS_RE.sub(" ", s)
+
+def norm_col(col: "pd.Series") -> "pd.Series":
+    """Column-wise norm(): NFKC + whitespace collapse via pandas' string kernels."""
+    return (col.fillna("").astype(str).str.normalize("NFKC")
+               .str.replace(_WS_RE, " ", regex=True).str.strip())
 
-def toks_name(s: str):
-    return re.findall(r"[A-Za-z0-9#\-/&']+", norm(s))
+@lru_cache(maxsize=100_000)
+def _toks_name_cached(s: str) -> tuple:
+    return tuple(_TOKS_RE.findall(norm(s)))
 
+@lru_cache(maxsize=100_000)
 def lower(s: str) -> str:
     return norm(s).lower()
 
-def build_stem(product_name: str, brand_tokens: set) -> str:
-    """Create a compact stem from product name, preserving 'shadow stick'."""
-    tokens = toks_name(product_name)
-    # special-case join 'shadow stick' into one unit if seen consecutively
-    joined = []
-    i = 0
-    while i < len(tokens):
-        t = tokens[i]
-        if i+1 < len(tokens) and lower(t) == "shadow" and lower(tokens[i+1]) == "stick":
-            joined.append("shadow stick")
-            i += 2
-        else:
-            joined.append(t)
-            i += 1
-
-    # remove brand tokens (lowercased), and generic stopwords
-    out = []
-    for t in joined:
-        t_l = lower(t)
-        if t_l in brand_tokens:             # drop brand words
-            continue
-        if t_l in STEM_STOPWORDS and t_l != "shadow stick":  # keep 'shadow stick' even if listed (it isn't)
-            continue
-        out.append(t)
-
-    stem = norm(" ".join(out))
-    return stem
+def build_stem(product_name: str, drop: set) -> str:
+    """Create a compact stem from product name, preserving 'shadow stick'; drop = stopwords | brand tokens."""
+    tokens = _toks_name_cached(product_name)
+    lows = [t.lower() for t in tokens]   # tokens are already norm()'d
+    if "shadow" in lows and "stick" in lows:
+        # special-case join 'shadow stick' into one unit if seen consecutively
+        joined, i = [], 0
+        while i < len(tokens):
+            if i+1 < len(tokens) and lows[i] == "shadow" and lows[i+1] == "stick":
+                joined.append(("shadow stick", "shadow stick"))
+                i += 2
+            else:
+                joined.append((tokens[i], lows[i]))
+                i += 1
+    else:
+        joined = zip(tokens, lows)
+    # 'shadow stick' is never in drop: brand tokens and stopwords are single words
+    return norm(" ".join(t for t, t_l in joined if t_l not in drop))
+
+@lru_cache(maxsize=1)
+def _strip_combining() -> dict:
+    """str.translate table mapping every combining mark to None; built on first non-ASCII shade."""
+    return dict.fromkeys(cp for cp in range(sys.maxunicode + 1) if unicodedata.combining(chr(cp)))
+
+@lru_cache(maxsize=50_000)
+def norm_shade(s: str) -> str:
+    """Lowercased, accent-free shade key. Expects an already norm()'d string."""
+    s = s.lower()
+    if s.isascii():
+        return _WS_RE.sub(" ", s).strip()
+    s = unicodedata.normalize("NFKD", s).translate(_strip_combining())
+    return _WS_RE.sub(" ", s).strip()
 
 def valid_stem(stem: str) -> bool:
     parts = stem.split()
     if not (STEM_MIN_TOK <= len(parts) <= STEM_MAX_TOK):
         return False
-    if re.fullmatch(r"[0-9#]+", stem):  # numeric-only
+    if _NUMERIC_RE.fullmatch(stem):  # numeric-only
         return False
     return True
 
+def _sorted_by(rows, key) -> list:
+    """Decorate-sort-undecorate: key() runs once per row; ties fall back to the row itself."""
+    decorated = [(key(r), r) for r in rows]
+    decorated.sort()
+    return [r for _, r in decorated]
+
+def _write_tsv(path: Path, rows) -> None:
+    """Write rows as one tab-joined block. Fields are norm()'d, so they hold no tabs/newlines."""
+    rows = list(rows)
+    path.write_text("\n".join("\t".join(map(str, r)) for r in rows) + ("\n" if rows else ""),
+                    encoding="utf-8")
+
+def _read_frame(path: str, engine: str) -> "pd.DataFrame":
+    """Load only CATALOG_COLS (those present) as strings; polars is optional and falls back to pandas."""
+    if engine == "polars":
+        try:
+            import polars as pl
+        except ImportError:
+            print("⚠️  polars not installed; falling back to pandas", file=sys.stderr)
+        else:
+            # lazy scan: projection pushdown parses only the selected columns, all as strings
+            lf = pl.scan_csv(path, infer_schema_length=0)
+            present = [c for c in CATALOG_COLS if c in lf.collect_schema().names()]
+            return lf.select(present).collect().to_pandas()
+    import pandas as pd
+    # only the columns we use, as plain strings ("" for blanks); a callable usecols
+    # tolerates catalogs that lack some of them
+    return pd.read_csv(path, usecols=lambda c: c in CATALOG_COLS, dtype=str,
+                       keep_default_na=False, engine="c")
+
+def read_catalog(path: str, engine: str = "csv") -> list:
+    """Unique normalized CATALOG_COLS tuples ("" for missing columns/fields), in file order."""
+    if engine != "csv":
+        df = _read_frame(path, engine)
+        for col in CATALOG_COLS:
+            if col not in df.columns: df[col] = ""
+            df[col] = norm_col(df[col])
+        return list(dict.fromkeys(df[CATALOG_COLS].itertuples(index=False, name=None)))
+    # default: stream the file once, norm() each field (cached) and dedup as we go
+    rows = {}
+    with open(path, newline="", encoding="utf-8-sig") as f:
+        rd = csv.reader(f)
+        header = next(rd, [])
+        idx = [header.index(c) if c in header else None for c in CATALOG_COLS]
+        for rec in rd:
+            if not rec: continue                     # blank line
+            n = len(rec)
+            rows[tuple(norm(rec[i]) if i is not None and i < n else "" for i in idx)] = None
+    return list(rows)
+
+def _process_rows(rows, brand_drop: dict):
+    """Fused pass over unique (brand, product, type, group, shade) rows -> (products, stems, shades) sets."""
+    # a stem depends only on (brand, product name): build it once per unique pair, not per shade row
+    stem_of = {}
+    for b, pn in dict.fromkeys((r[0], r[1]) for r in rows):
+        stem = build_stem(pn, brand_drop.get(b, STEM_STOPWORDS))
+        if stem and valid_stem(stem):
+            weight = 0.7 if _HEAVY_RE.search(stem.lower()) else 1.0   # stem is already norm()'d
+            stem_of[(b, pn)] = (stem, weight)
+    pf, stems, shades = set(), set(), set()
+    for b, pn, pt, cg, sh in rows:
+        pf.add((b,pn,pt,cg))
+        if (b, pn) in stem_of:
+            stem, weight = stem_of[(b, pn)]
+            stems.add((b, stem, pt, cg, weight))
+        if sh:
+            shades.add((b, pn, sh, norm_shade(sh)))
+    return pf, stems, shades
+
 # -------------------------
 # Main
 # -------------------------
@@ -127,17 +232,19 @@ def main():
     ap = argparse.ArgumentParser()
     ap.add_argument("--catalog", required=True, help="Path to sku_catalog.csv")
     ap.add_argument("--out", default="ner_training/gazetteers", help="Output dir")
+    ap.add_argument("--engine", choices=["csv","pandas","polars"], default="csv",
+                    help="CSV reader; pandas/polars (optional) for very large catalogs")
+    ap.add_argument("--workers", type=int, default=1,
+                    help="Processes for the product/stem/shade pass (0 = all cores)")
     args = ap.parse_args()
 
     out = Path(args.out); out.mkdir(parents=True, exist_ok=True)
-    df = pd.read_csv(args.catalog)
-    for col in ["Brand","Product Name","Product Type","Category Group","Shade Name"]:
-        if col not in df.columns: df[col] = ""
-        df[col] = df[col].map(norm)
+    catalog = read_catalog(args.catalog, args.engine)
 
     # -------- brands.tsv (sorted) --------
-    brands = sorted({b for b in df["Brand"].dropna() if b})
-    (out/"brands.tsv").write_text("\n".join(brands) + "\n", encoding="utf-8")
+    brands = sorted({r[0] for r in catalog if r[0]})
+    # tokenized once per unique brand; shared by the alias heuristic and the stem drop sets
+    brand_tok = {b: _toks_name_cached(b) for b in brands}
 
     # -------- brand_aliases.tsv (sorted by brand, then alias) --------
     alias_rows = []
@@ -146,74 +253,64 @@ def main():
         alias_rows.append((brand, alias, float(prio)))
     # heuristic: last token of brand as alias if unique
     last_tok = defaultdict(set)
-    for b in brands:
-        tk = toks_name(b)
+    for b, tk in brand_tok.items():
         if tk: last_tok[lower(tk[-1])].add(b)
     for lt, bset in last_tok.items():
         if len(bset) == 1 and lt not in {"beauty","cosmetics","makeup"}:
-            bname = list(bset)[0]
+            bname = next(iter(bset))
             alias_rows.append((bname, bname.split()[-1], 0.7))
 
-    # sort & dedup
-    alias_rows = sorted({(b,a,prio) for (b,a,prio) in alias_rows}, key=lambda x: (lower(x[0]), lower(x[1])))
-    with (out/"brand_aliases.tsv").open("w", encoding="utf-8", newline="") as f:
-        w = csv.writer(f, delimiter="\t")
-        for b,a,p in alias_rows:
-            w.writerow([a,b,p])
+    # sort & dedup; for the same brand/alias the stronger priority comes first
+    alias_rows = _sorted_by({(b,a,prio) for (b,a,prio) in alias_rows}, lambda x: (lower(x[0]), lower(x[1]), -x[2]))
+
+    # -------- one fused pass for products_full / products_stems / shades_master --------
+    brand_drop = {b: STEM_STOPWORDS | {t.lower() for t in tk} for b, tk in brand_tok.items()}
+    # rows with both a brand and a product name feed every product/shade table; read_catalog
+    # already deduped on the full row (the only identity that is safe: one product name can
+    # carry several types/groups), so repeated catalog rows skip stem building entirely
+    rows = [r for r in catalog if r[0] and r[1]]
+    workers = args.workers or os.cpu_count() or 1
+    if workers > 1 and len(rows) > workers:
+        # contiguous slices keep a product's shade rows together; the helpers are pure
+        size = -(-len(rows) // workers)
+        chunks = [rows[i:i+size] for i in range(0, len(rows), size)]
+        with ProcessPoolExecutor(max_workers=workers) as ex:
+            parts = list(ex.map(_process_rows, chunks, [brand_drop]*len(chunks)))
+        pf, stems, shades = (set().union(*sets) for sets in zip(*parts))
+    else:
+        pf, stems, shades = _process_rows(rows, brand_drop)
 
     # -------- products_full.tsv (sorted) --------
-    pf = set()
-    for _, r in df.iterrows():
-        b, pn, pt, cg = r["Brand"], r["Product Name"], r["Product Type"], r["Category Group"]
-        if not b or not pn: continue
-        pf.add((b,pn,pt,cg))
-    pf = sorted(pf, key=lambda x: (lower(x[0]), lower(x[1]), lower(x[2])))
-    with (out/"products_full.tsv").open("w", encoding="utf-8", newline="") as f:
-        w = csv.writer(f, delimiter="\t")
-        for row in pf: w.writerow(row)
+    pf = _sorted_by(pf, lambda x: (lower(x[0]), lower(x[1]), lower(x[2])))
 
     # -------- products_stems.tsv (sorted) --------
-    brand_tok = {b: {lower(t) for t in toks_name(b)} for b in brands}
-    stems = set()
-    for _, r in df.iterrows():
-        b, pn, pt, cg = r["Brand"], r["Product Name"], r["Product Type"], r["Category Group"]
-        if not b or not pn: continue
-        stem = build_stem(pn, brand_tok.get(b,set()))
-        if not stem or not valid_stem(stem): continue
-        weight = 0.7 if any(w in lower(stem) for w in ["tinted moisturizer","foundation","powder","palette","lip oil","lip gloss"]) else 1.0
-        stems.add((b, stem, pt, cg, weight))
-    stems = sorted(stems, key=lambda x: (lower(x[0]), lower(x[1])))
-    with (out/"products_stems.tsv").open("w", encoding="utf-8", newline="") as f:
-        w = csv.writer(f, delimiter="\t")
-        for row in stems: w.writerow(row)
+    stems = _sorted_by(stems, lambda x: (lower(x[0]), lower(x[1])))
 
     # -------- shades_master.tsv (sorted) --------
-    def norm_shade(s: str) -> str:
-        s = norm(s).lower()
-        s = unicodedata.normalize("NFKD", s)
-        s = "".join(c for c in s if not unicodedata.combining(c))
-        return re.sub(r"\s+", " ", s).strip()
-
-    shades = set()
-    for _, r in df.iterrows():
-        b, pn, sh = r["Brand"], r["Product Name"], r["Shade Name"]
-        if not b or not pn or not sh: continue
-        shades.add((b, pn, sh, norm_shade(sh)))
-    shades = sorted(shades, key=lambda x: (lower(x[0]), lower(x[1]), lower(x[2])))
-    with (out/"shades_master.tsv").open("w", encoding="utf-8", newline="") as f:
-        w = csv.writer(f, delimiter="\t")
-        for row in shades: w.writerow(row)
-
-    # -------- patterns & lists (sorted) --------
-    Path(out/"shade_patterns.txt").write_text("\n".join(sorted(SHADE_PATTERNS)) + "\n", encoding="utf-8")
-    Path(out/"tool_patterns.txt").write_text("\n".join(sorted(TOOL_PATTERNS)) + "\n", encoding="utf-8")
-    Path(out/"stop_phrases.txt").write_text("\n".join(sorted(set(STOP_PHRASES))) + "\n", encoding="utf-8")
+    shades = _sorted_by(shades, lambda x: (lower(x[0]), lower(x[1]), lower(x[2])))
 
+    # -------- tools.tsv (sorted) --------
     tools_sorted = sorted({(t,n,w) for (t,n,w) in TOOL_SEEDS}, key=lambda x: (lower(x[0]), x[2], lower(x[1])))
-    with (out/"tools.tsv").open("w", encoding="utf-8", newline="") as f:
-        w = csv.writer(f, delimiter="\t")
-        for t,n,wg in tools_sorted:
-            w.writerow([t,n,wg])
+
+    # -------- write (every table is final; the files are independent, so overlap the I/O) --------
+    texts = {
+        "brands.tsv":         "\n".join(brands) + "\n",
+        "shade_patterns.txt": _SHADE_TXT,
+        "tool_patterns.txt":  _TOOL_TXT,
+        "stop_phrases.txt":   _STOP_TXT,
+    }
+    tables = {
+        "brand_aliases.tsv":  [(a,b,p) for b,a,p in alias_rows],
+        "products_full.tsv":  pf,
+        "products_stems.tsv": stems,
+        "shades_master.tsv":  shades,
+        "tools.tsv":          tools_sorted,
+    }
+    with ThreadPoolExecutor(max_workers=4) as ex:
+        jobs = [ex.submit((out/name).write_text, text, encoding="utf-8") for name, text in texts.items()]
+        jobs += [ex.submit(_write_tsv, out/name, rows) for name, rows in tables.items()]
+    for job in jobs:
+        job.result()                                  # re-raise any write error
 
     # -------- Summary --------
     print("✅ Gazetteers written to:", out.resolve())
@@ -223,10 +320,10 @@ def main():
     print("  products_full.tsv    :", len(pf))
     print("  products_stems.tsv   :", len(stems))
     print("  shades_master.tsv    :", len(shades))
-    print("  shade_patterns.txt   :", len(SHADE_PATTERNS))
+    print("  shade_patterns.txt   :", len(_SHADE_SET))
     print("  tools.tsv            :", len(tools_sorted))
-    print("  tool_patterns.txt    :", len(TOOL_PATTERNS))
-    print("  stop_phrases.txt     :", len(set(STOP_PHRASES)))
+    print("  tool_patterns.txt    :", len(_TOOL_SET))
+    print("  stop_phrases.txt     :", len(_STOP_SET))
 
 if __name__ == "__main__":
     main()
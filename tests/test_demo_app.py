@@ -0,0 +1,56 @@
+import sys
+import pathlib
+from unittest import mock
+
+import pytest
+
+pd = pytest.importorskip("pandas")
+pytest.importorskip("pyarrow")
+pytest.importorskip("rapidfuzz")
+
+APP = pathlib.Path(__file__).resolve().parents[1] / "demo_app" / "app.py"
+
+
+class _Stop(Exception):
+    pass
+
+
+@pytest.fixture(scope="module")
+def app():
+    """Run app.py up to its no-upload st.stop() against a stand-in streamlit; return its globals."""
+    st = mock.MagicMock(name="streamlit")
+    st.cache_resource = st.cache_data = lambda f=None, **kw: f if f else (lambda g: g)
+    st.file_uploader.return_value = None
+    st.slider.side_effect = lambda label, lo, hi, value, *a, **kw: value
+    st.stop.side_effect = _Stop
+    ns = {"__name__": "app", "__file__": str(APP)}
+    with mock.patch.dict(sys.modules, {"streamlit": st}):
+        try:
+            exec(compile(APP.read_text(encoding="utf-8"), str(APP), "exec"), ns)
+        except _Stop:
+            pass
+    return ns
+
+
+def test_canon_series_collapses_unicode_whitespace(app):
+    s = pd.Series(["Charlotte\xa0Tilbury", " Pillow\u2009Talk\u3000\u3000Lipstick\v", None])
+    assert app["canon_series"](s).tolist() == ["Charlotte Tilbury", "Pillow Talk Lipstick", ""]
+
+
+@pytest.mark.parametrize("dtype, values, expected", [
+    ("null[pyarrow]", [None, None], ["", ""]),          # column blank in every catalog row
+    ("int64[pyarrow]", [12, None], ["12", ""]),
+])
+def test_canon_series_accepts_inferred_arrow_dtypes(app, dtype, values, expected):
+    assert app["canon_series"](pd.Series(values, dtype=dtype)).tolist() == expected
+
+
+def test_nbsp_kit_row_matches_within_its_brand(app):
+    kit = ("Brand,Product Name,Product Type\n"
+           "Charlotte\xa0Tilbury,Matte\xa0Revolution Lipstick,Lipstick\n"
+           "Urban\xa0Decay,Naked3\xa0Eyeshadow Palette,Eyeshadow Palette\n").encode("utf-8")
+    matched, _ = app["match_uploaded_kit"](kit, min_score=70)
+    assert matched["Matched Brand"].tolist() == ["Charlotte Tilbury", "Urban Decay"]
+    assert matched["Matched Product Name"].tolist() == ["Matte Revolution Lipstick",
+                                                        "Naked3 Eyeshadow Palette"]
+    assert matched["Match Score"].tolist() == [100, 100]